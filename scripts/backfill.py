@@ -0,0 +1,247 @@
+"""Batched, resumable backfills for recreate-and-copy migrations
+
+A migration opts in with two marker comments:
+
+    CREATE TABLE articles_new (...);            -- setup
+
+    -- @backfill articles -> articles_new key id
+    INSERT INTO articles_new (...)
+    SELECT ... FROM articles;                   -- copied in key-ordered chunks
+
+    -- @finalize
+    DROP TABLE articles;                        -- swap, indexes, views
+    ALTER TABLE articles_new RENAME TO articles;
+
+The copy statement must list its target columns and end with
+`FROM <source>`; the runner appends the key range for each chunk and an
+upsert on the key column, so rows already mirrored by the triggers are
+overwritten while a conflict on any other unique column still fails.
+
+Progress lives in `schema_backfill` as the last key copied, which unlike
+rowid survives a VACUUM, so a run that hits its time budget resumes where
+it stopped. Until finalize, triggers mirror writes on the source table
+into the target. Rows with a NULL key are copied during finalize, which
+then refuses to run unless source and target row counts match. A failed
+backfill is undone with `migrate.py --abort-backfill <version>`.
+"""
+import re
+import sqlite3
+import time
+
+BACKFILL_TABLE_SQL = """
+CREATE TABLE IF NOT EXISTS schema_backfill (
+    version TEXT PRIMARY KEY,
+    source TEXT NOT NULL,
+    target TEXT NOT NULL,
+    checksum TEXT NOT NULL,
+    last_key,
+    rows_copied INTEGER NOT NULL DEFAULT 0,
+    elapsed_ms INTEGER NOT NULL DEFAULT 0,
+    started_at TEXT DEFAULT (datetime('now')),
+    updated_at TEXT DEFAULT (datetime('now'))
+);
+"""
+
+BACKFILL_MARKER = re.compile(r"^--\s*@backfill\s+(\w+)\s*->\s*(\w+)\s+key\s+(\w+)\s*$", re.M)
+FINALIZE_MARKER = re.compile(r"^--\s*@finalize\s*$", re.M)
+LINE_COMMENT = re.compile(r"^\s*--[^\n]*$", re.M)
+COPY_STATEMENT = re.compile(r"^INSERT\s+INTO\s+(\w+)\s*\(([^)]*)\)\s*SELECT\b.*\bFROM\s+(\w+)$", re.I | re.S)
+
+
+def parse_backfill(sql):
+    """Split migration SQL into setup/copy/finalize phases, or None if not a backfill"""
+    marker = BACKFILL_MARKER.search(sql)
+    if not marker:
+        return None
+    source, target, key = marker.groups()
+    rest = sql[marker.end():]
+    finalize = FINALIZE_MARKER.search(rest)
+    if not finalize:
+        raise ValueError("@backfill migration is missing its -- @finalize marker")
+
+    # Only whole-line comments are dropped; '--' may appear inside string literals
+    copy = LINE_COMMENT.sub("", rest[:finalize.start()]).strip().rstrip(";").strip()
+    match = COPY_STATEMENT.match(copy)
+    if not match or len(_statements(copy)) != 1 or (match.group(1), match.group(3)) != (target, source):
+        raise ValueError(
+            f"@backfill section must be a single 'INSERT INTO {target} (...) "
+            f"SELECT ... FROM {source}' statement with no WHERE clause"
+        )
+    columns = [col.strip() for col in match.group(2).split(",")]
+    if key not in columns:
+        raise ValueError(f"@backfill key column {key} is not in the copied columns")
+    updates = ", ".join(f"{col} = excluded.{col}" for col in columns if col != key)
+    conflict = f"DO UPDATE SET {updates}" if updates else "DO NOTHING"
+    return {
+        "source": source,
+        "target": target,
+        "key": key,
+        "setup": sql[:marker.start()],
+        "copy": copy,
+        "upsert": f"ON CONFLICT({key}) {conflict}",
+        "finalize": rest[finalize.end():],
+    }
+
+
+def get_progress(conn, version):
+    """Return (last_key, rows_copied, elapsed_ms) for an in-progress backfill, else None"""
+    exists = conn.execute(
+        "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'schema_backfill'"
+    ).fetchone()
+    if not exists:
+        return None
+    return conn.execute(
+        "SELECT last_key, rows_copied, elapsed_ms FROM schema_backfill WHERE version = ?",
+        (version,),
+    ).fetchone()
+
+
+def started_checksums(conn):
+    """Return {version: checksum} of the migration files in-progress backfills started from"""
+    exists = conn.execute(
+        "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'schema_backfill'"
+    ).fetchone()
+    if not exists:
+        return {}
+    return dict(conn.execute("SELECT version, checksum FROM schema_backfill"))
+
+
+def _after(plan, last_key):
+    """WHERE clause and params selecting source rows past last_key"""
+    if last_key is None:
+        return f"WHERE {plan['key']} IS NOT NULL", ()
+    return f"WHERE {plan['key']} > ?", (last_key,)
+
+
+def count_remaining(conn, plan, last_key=None):
+    """Number of source rows still to be copied"""
+    where, params = _after(plan, last_key)
+    return conn.execute(f"SELECT COUNT(*) FROM {plan['source']} {where}", params).fetchone()[0]
+
+
+def _trigger_names(version):
+    return [f"_backfill_{version}_{op}" for op in ("ins", "upd", "del")]
+
+
+def start(conn, version, checksum, plan):
+    """Run the setup phase and install mirroring triggers in one transaction"""
+    started = time.perf_counter()
+    source, target, key = plan["source"], plan["target"], plan["key"]
+    mirror = f"{plan['copy']} WHERE {key} = NEW.{key} {plan['upsert']}"
+    ins, upd, dele = _trigger_names(version)
+    conn.executescript(f"""
+        BEGIN;
+        {BACKFILL_TABLE_SQL}
+        {plan['setup']};
+        CREATE TRIGGER {ins} AFTER INSERT ON {source} BEGIN
+            {mirror};
+        END;
+        CREATE TRIGGER {upd} AFTER UPDATE ON {source} BEGIN
+            DELETE FROM {target} WHERE {key} = OLD.{key};
+            {mirror};
+        END;
+        CREATE TRIGGER {dele} AFTER DELETE ON {source} BEGIN
+            DELETE FROM {target} WHERE {key} = OLD.{key};
+        END;
+    """)
+    conn.execute(
+        "INSERT INTO schema_backfill (version, source, target, checksum, elapsed_ms) "
+        "VALUES (?, ?, ?, ?, ?)",
+        (version, source, target, checksum, int((time.perf_counter() - started) * 1000)),
+    )
+    conn.execute("COMMIT")
+
+
+def copy_chunks(conn, version, plan, batch_size, deadline=None):
+    """Copy rows in key order, one transaction per chunk. Returns True when done."""
+    key, source = plan["key"], plan["source"]
+    last_key, rows_copied, elapsed_ms = get_progress(conn, version)
+    total = rows_copied + count_remaining(conn, plan, last_key)
+
+    while True:
+        if deadline is not None and time.monotonic() >= deadline:
+            return False
+        started = time.perf_counter()
+        conn.execute("BEGIN IMMEDIATE")
+        where, params = _after(plan, last_key)
+        upper, chunk_rows = conn.execute(
+            f"SELECT MAX({key}), COUNT(*) FROM "
+            f"(SELECT {key} FROM {source} {where} ORDER BY {key} LIMIT ?)",
+            (*params, batch_size),
+        ).fetchone()
+        if upper is None:
+            conn.execute("COMMIT")
+            return True
+        # rowcount would also count upserts of mirrored rows; count source rows instead
+        conn.execute(f"{plan['copy']} {where} AND {key} <= ? {plan['upsert']}", (*params, upper))
+        last_key, rows_copied = upper, rows_copied + chunk_rows
+        elapsed_ms += int((time.perf_counter() - started) * 1000)
+        conn.execute(
+            "UPDATE schema_backfill SET last_key = ?, rows_copied = ?, elapsed_ms = ?, "
+            "updated_at = datetime('now') WHERE version = ?",
+            (last_key, rows_copied, elapsed_ms, version),
+        )
+        conn.execute("COMMIT")
+        print(f"  {plan['source']} -> {plan['target']}: {rows_copied}/{total} rows")
+
+
+def _statements(sql):
+    """Split a SQL script into complete statements so they run inside the caller's transaction"""
+    statements, start = [], 0
+    for end, char in enumerate(sql, 1):
+        # complete_statement skips semicolons in strings, comments and trigger bodies
+        if char == ";" and sqlite3.complete_statement(sql[start:end]):
+            statements.append(sql[start:end].strip())
+            start = end
+    if LINE_COMMENT.sub("", sql[start:]).strip():
+        statements.append(sql[start:].strip() + "\n;")
+    return statements
+
+
+def finish(conn, version, plan):
+    """Verify the copy, drop triggers and run the finalize phase. Caller commits.
+
+    Returns elapsed_ms so far.
+    """
+    elapsed_ms = get_progress(conn, version)[2]
+    conn.execute("BEGIN IMMEDIATE")
+    # NULL keys can't be walked in key order or matched by the triggers (legacy
+    # TEXT primary keys allow them), so copy those rows here under the write lock
+    conn.execute(f"{plan['copy']} WHERE {plan['key']} IS NULL {plan['upsert']}")
+    source_rows, target_rows = (
+        conn.execute(f"SELECT COUNT(*) FROM {table}").fetchone()[0]
+        for table in (plan["source"], plan["target"])
+    )
+    if source_rows != target_rows:
+        raise sqlite3.IntegrityError(
+            f"backfill {plan['source']} -> {plan['target']} copied {target_rows} of {source_rows} rows"
+        )
+    for name in _trigger_names(version):
+        conn.execute(f"DROP TRIGGER IF EXISTS {name}")
+    for statement in _statements(plan["finalize"]):
+        conn.execute(statement)
+    conn.execute("DELETE FROM schema_backfill WHERE version = ?", (version,))
+    return elapsed_ms
+
+
+def abort(conn, version):
+    """Drop the triggers, target table and progress of a backfill in one transaction.
+
+    Returns False if no backfill is in progress for version.
+    """
+    if get_progress(conn, version) is None:
+        return False
+    target = conn.execute(
+        "SELECT target FROM schema_backfill WHERE version = ?", (version,)
+    ).fetchone()[0]
+    conn.execute("BEGIN IMMEDIATE")
+    try:
+        for name in _trigger_names(version):
+            conn.execute(f"DROP TRIGGER IF EXISTS {name}")
+        conn.execute(f"DROP TABLE IF EXISTS {target}")
+        conn.execute("DELETE FROM schema_backfill WHERE version = ?", (version,))
+        conn.execute("COMMIT")
+    except sqlite3.Error:
+        conn.execute("ROLLBACK")
+        raise
+    return True
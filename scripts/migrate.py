@@ -1,40 +1,220 @@
+import argparse
+import hashlib
 import sqlite3
+import time
 from pathlib import Path
 
+import backfill
+
 DB_PATH = Path("public/data/history.db")
 MIGRATIONS_DIR = Path("sql/migrations")
+BATCH_SIZE = 5000
 
 SCHEMA_TABLE_SQL = """
 CREATE TABLE IF NOT EXISTS schema_version (
     version TEXT PRIMARY KEY,
-    applied_at TEXT DEFAULT (datetime('now'))
+    applied_at TEXT DEFAULT (datetime('now')),
+    checksum TEXT,
+    duration_ms INTEGER
 );
 """
 
+# Feed items script_archive.py could not write because articles predates the
+# archive columns (e.g. a legacy table mid-0002); replayed once the schema is ready.
+# Bootstrapped here rather than in sql/migrations since it must exist before
+# pending migrations finish.
+ARCHIVE_BACKLOG_SQL = """
+CREATE TABLE IF NOT EXISTS archive_backlog (
+    hash TEXT PRIMARY KEY,
+    entry TEXT NOT NULL,
+    first_seen_dt INTEGER NOT NULL,
+    last_seen_dt INTEGER NOT NULL
+);
+"""
+
+# Columns added to schema_version after databases were already created with it
+SCHEMA_EXTRA_COLUMNS = {"checksum": "TEXT", "duration_ms": "INTEGER"}
+
+
+def list_migrations():
+    """Return (version, path, checksum) for each migration, ordered by filename"""
+    migrations = []
+    for path in sorted(MIGRATIONS_DIR.glob("*.sql")):
+        checksum = hashlib.sha256(path.read_bytes()).hexdigest()
+        migrations.append((path.stem.split("_")[0], path, checksum))
+    return migrations
+
+
+def ensure_schema_table(conn):
+    conn.execute(SCHEMA_TABLE_SQL)
+    conn.execute(ARCHIVE_BACKLOG_SQL)
+    columns = {row[1] for row in conn.execute("PRAGMA table_info(schema_version)")}
+    for name, col_type in SCHEMA_EXTRA_COLUMNS.items():
+        if name not in columns:
+            conn.execute(f"ALTER TABLE schema_version ADD COLUMN {name} {col_type}")
+
+
 def get_applied_versions(conn):
-    cur = conn.cursor()
-    cur.execute(SCHEMA_TABLE_SQL)
-    cur.execute("SELECT version FROM schema_version ORDER BY version")
-    return {row[0] for row in cur.fetchall()}
+    """Return {version: checksum} for applied migrations (checksum may be None)"""
+    columns = {row[1] for row in conn.execute("PRAGMA table_info(schema_version)")}
+    if not columns:
+        return {}
+    checksum = "checksum" if "checksum" in columns else "NULL"
+    return dict(conn.execute(f"SELECT version, {checksum} FROM schema_version ORDER BY version"))
 
-def apply_migration(conn, path: Path):
-    sql = path.read_text(encoding="utf-8")
-    conn.executescript(sql)
 
-def main():
-    DB_PATH.parent.mkdir(parents=True, exist_ok=True)
-    conn = sqlite3.connect(DB_PATH)
+def check_checksums(recorded, migrations):
+    """Return names of applied or partly backfilled migrations whose file changed since they ran"""
+    return [
+        path.name for version, path, checksum in migrations
+        if recorded.get(version) not in (None, checksum)
+    ]
+
+
+def pending_migrations(conn):
+    """Return (version, path, checksum) for migrations not yet fully applied"""
+    applied = get_applied_versions(conn)
+    return [m for m in list_migrations() if m[0] not in applied]
+
+
+def record_version(conn, version, checksum, duration_ms):
+    conn.execute(
+        "INSERT INTO schema_version (version, checksum, duration_ms) VALUES (?, ?, ?)",
+        (version, checksum, duration_ms),
+    )
+
+
+def apply_migration(conn, version, checksum, sql):
+    """Run one migration and record it in schema_version, all in a single transaction"""
+    started = time.perf_counter()
+    try:
+        conn.executescript(f"BEGIN;\n{sql}\n;")
+        duration_ms = int((time.perf_counter() - started) * 1000)
+        record_version(conn, version, checksum, duration_ms)
+        conn.execute("COMMIT")
+    except sqlite3.Error:
+        if conn.in_transaction:
+            conn.execute("ROLLBACK")
+        raise
+    return duration_ms
+
+
+def apply_backfill(conn, version, checksum, plan, batch_size, deadline):
+    """Advance a batched backfill migration. Returns duration_ms once applied, else None"""
     try:
+        if backfill.get_progress(conn, version) is None:
+            backfill.start(conn, version, checksum, plan)
+        if not backfill.copy_chunks(conn, version, plan, batch_size, deadline):
+            return None
+        started = time.perf_counter()
+        duration_ms = backfill.finish(conn, version, plan)
+        duration_ms += int((time.perf_counter() - started) * 1000)
+        record_version(conn, version, checksum, duration_ms)
+        conn.execute("COMMIT")
+    except sqlite3.Error:
+        if conn.in_transaction:
+            conn.execute("ROLLBACK")
+        raise
+    return duration_ms
+
+
+def describe_pending(conn, pending):
+    if not pending:
+        print("Database is up to date")
+    for version, path, checksum in pending:
+        print(f"Would apply {path.name} (sha256 {checksum[:12]})")
+        plan = backfill.parse_backfill(path.read_text(encoding="utf-8"))
+        if plan is None:
+            continue
+        progress = backfill.get_progress(conn, version) if conn else None
+        if progress:
+            remaining = backfill.count_remaining(conn, plan, progress[0])
+            print(f"  backfill in progress: {progress[1]} rows copied, {remaining} remaining")
+        else:
+            print(f"  batched backfill {plan['source']} -> {plan['target']}")
+
+
+def run_migrations(db_path=DB_PATH, dry_run=False, batch_size=BATCH_SIZE, max_seconds=None):
+    """Apply pending migrations. Returns True once the schema is fully up to date."""
+    db_path = Path(db_path)
+    if dry_run and not db_path.exists():
+        describe_pending(None, list_migrations())
+        return False
+
+    if dry_run:
+        conn = sqlite3.connect(f"file:{db_path}?mode=ro", uri=True)
+    else:
+        db_path.parent.mkdir(parents=True, exist_ok=True)
+        # Autocommit mode: every migration and backfill chunk manages its own transaction
+        conn = sqlite3.connect(db_path, isolation_level=None)
+    deadline = time.monotonic() + max_seconds if max_seconds is not None else None
+
+    try:
+        migrations = list_migrations()
+        if not dry_run:
+            ensure_schema_table(conn)
         applied = get_applied_versions(conn)
-        # Migrations are ordered by filename
-        for mig in sorted(MIGRATIONS_DIR.glob("*.sql")):
-            version = mig.stem.split("_")[0]
-            if version not in applied:
-                print(f"Applying migration {mig.name}")
-                apply_migration(conn, mig)
-        conn.commit()
+        # An in-progress backfill must resume from the same file it started with
+        changed = check_checksums({**backfill.started_checksums(conn), **applied}, migrations)
+        if changed:
+            raise SystemExit(f"Applied migrations were modified since they ran: {', '.join(changed)}")
+
+        pending = [m for m in migrations if m[0] not in applied]
+        if dry_run:
+            describe_pending(conn, pending)
+            return not pending
+
+        # Databases migrated before checksums were tracked adopt the current files
+        for version, path, checksum in migrations:
+            if version in applied and applied[version] is None:
+                conn.execute("UPDATE schema_version SET checksum = ? WHERE version = ?", (checksum, version))
+
+        for version, path, checksum in pending:
+            if deadline is not None and time.monotonic() >= deadline:
+                print(f"Time budget reached; {path.name} and later migrations deferred")
+                return False
+            sql = path.read_text(encoding="utf-8")
+            plan = backfill.parse_backfill(sql)
+            print(f"Applying migration {path.name}")
+            if plan is None:
+                duration_ms = apply_migration(conn, version, checksum, sql)
+            else:
+                duration_ms = apply_backfill(conn, version, checksum, plan, batch_size, deadline)
+                if duration_ms is None:
+                    print(f"Time budget reached; backfill for {path.name} will resume next run")
+                    return False
+            print(f"  applied in {duration_ms} ms")
+        return True
     finally:
         conn.close()
 
+
+def abort_backfill(db_path, version):
+    """Undo an in-progress backfill so the migration can be fixed and rerun from scratch"""
+    conn = sqlite3.connect(db_path, isolation_level=None)
+    try:
+        if backfill.abort(conn, version):
+            print(f"Aborted backfill for migration {version}; it will restart on the next run")
+        else:
+            print(f"No backfill in progress for migration {version}")
+    finally:
+        conn.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Apply SQL migrations to the history database")
+    parser.add_argument("--db", type=Path, default=DB_PATH)
+    parser.add_argument("--dry-run", action="store_true", help="list pending migrations without applying them")
+    parser.add_argument("--batch-size", type=int, default=BATCH_SIZE, help="rows per backfill chunk")
+    parser.add_argument("--max-seconds", type=float, help="stop between chunks after this long; resumes next run")
+    parser.add_argument("--abort-backfill", metavar="VERSION",
+                        help="drop the triggers, target table and progress of a failed backfill")
+    args = parser.parse_args()
+    if args.abort_backfill:
+        abort_backfill(args.db, args.abort_backfill)
+    else:
+        run_migrations(args.db, args.dry_run, args.batch_size, args.max_seconds)
+
+
 if __name__ == "__main__":
     main()
@@ -1,66 +1,25 @@
-import json, sqlite3, hashlib, datetime
+import json, sqlite3, hashlib, datetime, sys
 from email.utils import parsedate_to_datetime
 
 DB_PATH = "public/data/history.db"
 DATA_PATH = "public/data/articles.json"
 
-conn = sqlite3.connect(DB_PATH)
-cur = conn.cursor()
+ARCHIVE_COLUMNS = {"id", "title", "link", "source", "published_str", "published_dt",
+                   "first_seen_dt", "last_seen_dt", "tags", "hash"}
 
-# Check if migration is needed
-cur.execute("PRAGMA table_info(articles)")
-columns = {row[1] for row in cur.fetchall()}
-
-if 'first_seen' in columns:  # Old schema detected
-    # Migrate to new schema
-    cur.execute("""
-    CREATE TABLE articles_new (
-        id TEXT PRIMARY KEY,
-        title TEXT NOT NULL,
-        link TEXT NOT NULL,
-        source TEXT NOT NULL,
-        published_str TEXT,
-        published_dt INTEGER,
-        first_seen_dt INTEGER NOT NULL,
-        last_seen_dt INTEGER NOT NULL,
-        hash TEXT NOT NULL UNIQUE
-    )
-    """)
-    
-    # Copy data, converting text dates to timestamps
-    cur.execute("""
-    INSERT INTO articles_new (id, title, link, source, published_str, published_dt, first_seen_dt, last_seen_dt, hash)
-    SELECT id, title, link, source, published, NULL, 
-           strftime('%s', first_seen), strftime('%s', last_seen), hash
-    FROM articles
-    """)
-    
-    cur.execute("DROP TABLE articles")
-    cur.execute("ALTER TABLE articles_new RENAME TO articles")
-else:
-    # Create table with new schema if it doesn't exist
-    cur.execute("""
-    CREATE TABLE IF NOT EXISTS articles (
-        id TEXT PRIMARY KEY,
-        title TEXT NOT NULL,
-        link TEXT NOT NULL,
-        source TEXT NOT NULL,
-        published_str TEXT,
-        published_dt INTEGER,
-        first_seen_dt INTEGER NOT NULL,
-        last_seen_dt INTEGER NOT NULL,
-        hash TEXT NOT NULL UNIQUE
-    )
-    """)
+# archive_backlog holds one row per article, so it grows with distinct articles
+# rather than runs; warn well before it bloats the committed history.db
+BACKLOG_WARN_ROWS = 5000
 
-now = int(datetime.datetime.utcnow().timestamp())
 
-with open(DATA_PATH, encoding='utf-8') as f:
-    items = json.load(f)
-
-for entry in items:
+def entry_key(entry):
     uid = entry.get("link") or entry.get("title")
-    h = hashlib.sha256(uid.encode("utf-8")).hexdigest()
+    return uid, hashlib.sha256(uid.encode("utf-8")).hexdigest()
+
+
+def archive_entry(cur, entry, first_seen, last_seen):
+    """Insert a new article or refresh last_seen_dt/tags for a known one"""
+    uid, h = entry_key(entry)
 
     cur.execute("SELECT id FROM articles WHERE hash = ?", (h,))
     exists = cur.fetchone()
@@ -68,11 +27,11 @@ for entry in items:
     # Get tags (from classification step)
     tags = entry.get("tags", [])
     tags_json = json.dumps(tags)
-    
+
     if exists:
         cur.execute(
             "UPDATE articles SET last_seen_dt=?, tags=? WHERE hash=?",
-            (now, tags_json, h)
+            (last_seen, tags_json, h)
         )
     else:
         # Parse published date string to timestamp
@@ -84,7 +43,7 @@ for entry in items:
                 published_dt = int(dt.timestamp())
             except (ValueError, TypeError):
                 pass  # Keep as None if parsing fails
-        
+
         cur.execute("""
             INSERT INTO articles (id, title, link, source, published_str, published_dt, first_seen_dt, last_seen_dt, tags, hash)
             VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
@@ -95,11 +54,48 @@ for entry in items:
             entry.get("source"),
             published_str,
             published_dt,
-            now,
-            now,
+            first_seen,
+            last_seen,
             tags_json,
             h
         ))
 
+
+conn = sqlite3.connect(DB_PATH)
+cur = conn.cursor()
+
+now = int(datetime.datetime.utcnow().timestamp())
+
+with open(DATA_PATH, encoding='utf-8') as f:
+    items = json.load(f)
+
+cur.execute("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'archive_backlog'")
+if not cur.fetchone():
+    conn.close()
+    sys.exit("history.db has not been initialised; run scripts/migrate.py first")
+
+# During a batched backfill (see migrate.py) articles keeps taking writes and
+# triggers mirror them into the new table. Only a schema that predates these
+# columns, e.g. a legacy table mid-0002, makes us buffer the feed instead.
+cur.execute("PRAGMA table_info(articles)")
+if ARCHIVE_COLUMNS <= {row[1] for row in cur.fetchall()}:
+    cur.execute("SELECT entry, first_seen_dt, last_seen_dt FROM archive_backlog")
+    for entry, first_seen, last_seen in cur.fetchall():
+        archive_entry(cur, json.loads(entry), first_seen, last_seen)
+    cur.execute("DELETE FROM archive_backlog")
+    for entry in items:
+        archive_entry(cur, entry, now, now)
+else:
+    for entry in items:
+        cur.execute("""
+            INSERT INTO archive_backlog (hash, entry, first_seen_dt, last_seen_dt) VALUES (?, ?, ?, ?)
+            ON CONFLICT(hash) DO UPDATE SET entry = excluded.entry, last_seen_dt = excluded.last_seen_dt
+        """, (entry_key(entry)[1], json.dumps(entry), now, now))
+    cur.execute("SELECT COUNT(*) FROM archive_backlog")
+    backlog_rows = cur.fetchone()[0]
+    print(f"articles table awaiting migration; {backlog_rows} articles buffered in archive_backlog")
+    if backlog_rows > BACKLOG_WARN_ROWS:
+        print(f"WARNING: archive_backlog exceeds {BACKLOG_WARN_ROWS} articles; finish or abort the pending migration")
+
 conn.commit()
 conn.close()
@@ -0,0 +1,253 @@
+"""Exercise migrate.py and backfill.py against throwaway databases
+
+Run from the repo root: python3 scripts/verify_migrations.py
+Each scenario builds its own database in a temp directory and asserts on
+the result; the real public/data/history.db is never touched.
+"""
+import json
+import shutil
+import sqlite3
+import subprocess
+import sys
+import tempfile
+from pathlib import Path
+
+import migrate
+
+SCRIPTS_DIR = Path(__file__).resolve().parent
+REPO_MIGRATIONS = migrate.MIGRATIONS_DIR.resolve()
+
+
+def make_legacy_db(path, rows, duplicate_hash=False):
+    """Database at version 0001 (text timestamps) with `rows` articles"""
+    conn = sqlite3.connect(path)
+    # schema_version as created before checksums were tracked
+    conn.execute("CREATE TABLE schema_version (version TEXT PRIMARY KEY, applied_at TEXT DEFAULT (datetime('now')))")
+    conn.executescript((REPO_MIGRATIONS / "0001_initial.sql").read_text(encoding="utf-8"))
+    conn.executemany(
+        "INSERT INTO articles VALUES (?, ?, 'link', 'source', 'pub', '2025-01-01 00:00:00', '2025-01-02 00:00:00', ?)",
+        [(f"id{i:06d}", f"title {i}", "SAME" if duplicate_hash and i < 2 else f"hash{i}") for i in range(rows)],
+    )
+    conn.execute("INSERT INTO schema_version (version) VALUES ('0001')")
+    conn.commit()
+    conn.close()
+
+
+def run_for_ticks(db, ticks, batch_size):
+    """run_migrations with a clock that advances one second per budget check,
+    so an interrupted run stops after a fixed number of chunks"""
+    real_monotonic = migrate.time.monotonic
+    migrate.time.monotonic = iter(range(10 ** 9)).__next__
+    try:
+        return migrate.run_migrations(db, batch_size=batch_size, max_seconds=ticks)
+    finally:
+        migrate.time.monotonic = real_monotonic
+
+
+def query(path, sql):
+    conn = sqlite3.connect(path)
+    try:
+        return conn.execute(sql).fetchall()
+    finally:
+        conn.close()
+
+
+def check_fresh(tmp):
+    db = tmp / "fresh.db"
+    assert migrate.run_migrations(db)
+    versions = query(db, "SELECT version, checksum, duration_ms FROM schema_version ORDER BY version")
+    assert [v[0] for v in versions] == ["0001", "0002", "0003"]
+    assert all(checksum and duration is not None for _, checksum, duration in versions)
+    assert migrate.run_migrations(db, dry_run=True)
+
+
+def check_interrupted_resume(tmp):
+    db = tmp / "legacy.db"
+    make_legacy_db(db, 20000)
+    assert not run_for_ticks(db, 4, batch_size=1000)
+    assert not run_for_ticks(db, 4, batch_size=1000)
+    assert query(db, "SELECT last_key, rows_copied FROM schema_backfill") == [("id003999", 4000)]
+
+    # Writes to the old table on both sides of last_key while the copy is paused
+    conn = sqlite3.connect(db)
+    conn.execute("UPDATE articles SET title = 'changed' WHERE id IN ('id000001', 'id019999')")
+    conn.execute("DELETE FROM articles WHERE id IN ('id000002', 'id019998')")
+    conn.execute("INSERT INTO articles VALUES ('id999999', 'new', 'l', 's', 'p', '2025-01-01', '2025-01-03', 'hashnew')")
+    conn.commit()
+    conn.execute("VACUUM")  # may renumber rowids; progress is keyed on id
+    conn.close()
+
+    assert migrate.run_migrations(db, batch_size=1000)
+    assert query(db, "SELECT COUNT(*) FROM articles") == [(19999,)]
+    assert query(db, "SELECT COUNT(*) FROM articles WHERE title = 'changed'") == [(2,)]
+    assert query(db, "SELECT COUNT(*) FROM articles WHERE id IN ('id000002', 'id019998')") == [(0,)]
+    assert query(db, "SELECT name FROM sqlite_master WHERE type = 'trigger'") == []
+
+
+def check_duplicate_hash_fails(tmp):
+    db = tmp / "duplicate.db"
+    make_legacy_db(db, 10, duplicate_hash=True)
+    try:
+        migrate.run_migrations(db, batch_size=4)
+    except sqlite3.IntegrityError:
+        pass
+    else:
+        raise AssertionError("duplicate hash was copied without error")
+    assert query(db, "SELECT COUNT(*) FROM articles") == [(10,)]
+    assert query(db, "SELECT version FROM schema_version") == [("0001",)]
+
+    # Abort clears the half-built backfill; once the data is fixed it reruns cleanly
+    migrate.abort_backfill(db, "0002")
+    assert query(db, "SELECT name FROM sqlite_master WHERE type = 'trigger' OR name = 'articles_new'") == []
+    assert query(db, "SELECT COUNT(*) FROM schema_backfill") == [(0,)]
+    conn = sqlite3.connect(db)
+    conn.execute("UPDATE articles SET hash = 'fixed' WHERE id = 'id000001'")
+    conn.commit()
+    conn.close()
+    assert migrate.run_migrations(db, batch_size=4)
+    assert query(db, "SELECT COUNT(*) FROM articles") == [(10,)]
+
+
+def check_null_keys(tmp):
+    """Legacy TEXT primary keys allow NULL ids; those rows are copied at finalize"""
+    db = tmp / "null_key.db"
+    make_legacy_db(db, 5)
+    conn = sqlite3.connect(db)
+    conn.execute("INSERT INTO articles VALUES (NULL, 'no id', 'l', 's', 'p', '2025-01-01', '2025-01-02', 'hashnull')")
+    conn.commit()
+    conn.close()
+    assert migrate.run_migrations(db, batch_size=2)
+    assert query(db, "SELECT COUNT(*) FROM articles WHERE id IS NULL") == [(1,)]
+    assert query(db, "SELECT COUNT(*) FROM articles") == [(6,)]
+
+
+def check_failing_migration_rolls_back(tmp, migrations):
+    db = tmp / "failing.db"
+    assert migrate.run_migrations(db)
+    (migrations / "0004_broken.sql").write_text("CREATE TABLE half_done (x);\nINSERT INTO missing VALUES (1);\n")
+    try:
+        migrate.run_migrations(db)
+    except sqlite3.OperationalError:
+        pass
+    else:
+        raise AssertionError("broken migration succeeded")
+    finally:
+        (migrations / "0004_broken.sql").unlink()
+    assert query(db, "SELECT name FROM sqlite_master WHERE name = 'half_done'") == []
+    assert query(db, "SELECT MAX(version) FROM schema_version") == [("0003",)]
+
+
+def check_checksum_mismatch(tmp, migrations):
+    db = tmp / "checksum.db"
+    assert migrate.run_migrations(db)
+    original = (migrations / "0003_add_tags.sql").read_text(encoding="utf-8")
+    (migrations / "0003_add_tags.sql").write_text(original + "\n-- edited\n")
+    try:
+        migrate.run_migrations(db)
+    except SystemExit as exc:
+        assert "0003_add_tags.sql" in str(exc)
+    else:
+        raise AssertionError("edited migration was not detected")
+    finally:
+        (migrations / "0003_add_tags.sql").write_text(original)
+
+
+def check_backfill_edited_mid_copy(tmp, migrations):
+    db = tmp / "edited_backfill.db"
+    make_legacy_db(db, 50)
+    assert not run_for_ticks(db, 3, batch_size=20)
+    path = migrations / "0002_datetime_columns.sql"
+    original = path.read_text(encoding="utf-8")
+    path.write_text(original.replace("COALESCE(title, '')", "upper(COALESCE(title, ''))"))
+    try:
+        migrate.run_migrations(db)
+    except SystemExit as exc:
+        assert "0002_datetime_columns.sql" in str(exc)
+    else:
+        raise AssertionError("backfill resumed from an edited migration")
+    finally:
+        path.write_text(original)
+    assert migrate.run_migrations(db)
+    assert query(db, "SELECT COUNT(*) FROM articles WHERE title = upper(title)") == [(0,)]
+
+
+def check_archive_during_backfill(tmp, migrations):
+    """script_archive.py writes to the old table mid-backfill; triggers carry the rows across"""
+    root = tmp / "archive"
+    db = root / "public/data/history.db"
+    db.parent.mkdir(parents=True)
+    assert migrate.run_migrations(db)
+    conn = sqlite3.connect(db)
+    conn.executemany(
+        "INSERT INTO articles (id, title, link, source, first_seen_dt, last_seen_dt, hash) VALUES (?, 't', 'l', 's', 1, 1, ?)",
+        [(f"seed{i:05d}", f"seed{i}") for i in range(5000)],
+    )
+    conn.commit()
+    conn.close()
+
+    columns = "id, title, link, source, published_str, published_dt, first_seen_dt, last_seen_dt, tags, hash"
+    (migrations / "0004_rebuild.sql").write_text(
+        "CREATE TABLE articles_new AS SELECT * FROM articles WHERE 0;\n"
+        "CREATE UNIQUE INDEX idx_new_id ON articles_new(id);\n"
+        "-- @backfill articles -> articles_new key id\n"
+        f"INSERT INTO articles_new ({columns})\nSELECT {columns} FROM articles;\n"
+        "-- @finalize\nDROP VIEW articles_readable;\nDROP TABLE articles;\n"
+        "ALTER TABLE articles_new RENAME TO articles;\n"
+        "CREATE VIEW articles_readable AS SELECT * FROM articles;\n"
+    )
+    try:
+        assert not run_for_ticks(db, 3, batch_size=100)
+        feed = [{"title": "fresh", "link": "https://example.org/fresh", "source": "x", "tags": ["a"]}]
+        (db.parent / "articles.json").write_text(json.dumps(feed))
+        subprocess.run([sys.executable, str(SCRIPTS_DIR / "script_archive.py")], cwd=root, check=True)
+        assert migrate.run_migrations(db)
+    finally:
+        (migrations / "0004_rebuild.sql").unlink()
+    assert query(db, "SELECT COUNT(*) FROM articles") == [(5001,)]
+    assert query(db, "SELECT tags FROM articles WHERE title = 'fresh'") == [('["a"]',)]
+
+
+def check_archive_buffers_legacy(tmp):
+    """A legacy articles table can't take archive writes; feed items wait in archive_backlog"""
+    root = tmp / "buffer"
+    db = root / "public/data/history.db"
+    db.parent.mkdir(parents=True)
+    make_legacy_db(db, 100)
+    assert not run_for_ticks(db, 3, batch_size=10)
+    feed = [{"title": f"item {i}", "link": f"https://example.org/{i}", "source": "x"} for i in range(3)]
+    (db.parent / "articles.json").write_text(json.dumps(feed))
+    for _ in range(2):
+        subprocess.run([sys.executable, str(SCRIPTS_DIR / "script_archive.py")], cwd=root, check=True)
+    assert query(db, "SELECT COUNT(*) FROM archive_backlog") == [(3,)]
+
+    assert migrate.run_migrations(db)
+    subprocess.run([sys.executable, str(SCRIPTS_DIR / "script_archive.py")], cwd=root, check=True)
+    assert query(db, "SELECT COUNT(*) FROM archive_backlog") == [(0,)]
+    assert query(db, "SELECT COUNT(*) FROM articles WHERE link LIKE 'https://example.org/%'") == [(3,)]
+
+
+def main():
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        tmp = Path(tmp_dir)
+        migrations = tmp / "migrations"
+        shutil.copytree(REPO_MIGRATIONS, migrations)
+        migrate.MIGRATIONS_DIR = migrations
+
+        checks = [
+            (check_fresh, ()),
+            (check_interrupted_resume, ()),
+            (check_duplicate_hash_fails, ()),
+            (check_null_keys, ()),
+            (check_failing_migration_rolls_back, (migrations,)),
+            (check_checksum_mismatch, (migrations,)),
+            (check_backfill_edited_mid_copy, (migrations,)),
+            (check_archive_during_backfill, (migrations,)),
+            (check_archive_buffers_legacy, ()),
+        ]
+        for check, extra in checks:
+            check(tmp, *extra)
+            print(f"ok  {check.__name__}")
+
+
+if __name__ == "__main__":
+    main()
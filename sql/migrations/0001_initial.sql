@@ -10,6 +10,3 @@ CREATE TABLE IF NOT EXISTS articles (
     last_seen TEXT,
     hash TEXT
 );
-
--- Record schema version
-INSERT INTO schema_version(version) VALUES ('0001') ON CONFLICT DO NOTHING;
\ No newline at end of file
@@ -1,7 +1,6 @@
 -- 0002_datetime_columns.sql
 -- Recreate-and-copy to new schema with INTEGER timestamps
-
-BEGIN TRANSACTION;
+-- The copy runs as a batched backfill (see scripts/backfill.py)
 
 -- Create new table
 CREATE TABLE articles_new (
@@ -16,7 +15,8 @@ CREATE TABLE articles_new (
     hash TEXT NOT NULL UNIQUE
 );
 
--- Copy and transform data from old table if exists
+-- Copy and transform data from old table in chunks
+-- @backfill articles -> articles_new key id
 INSERT INTO articles_new (id, title, link, source, published_str, published_dt, first_seen_dt, last_seen_dt, hash)
 SELECT 
     id,
@@ -30,6 +30,7 @@ SELECT
     hash
 FROM articles;
 
+-- @finalize
 -- Replace old table
 DROP TABLE articles;
 ALTER TABLE articles_new RENAME TO articles;
@@ -53,8 +54,3 @@ SELECT
     datetime(last_seen_dt, 'unixepoch') as last_seen_datetime,
     hash
 FROM articles;
-
--- Record schema version
-INSERT INTO schema_version(version) VALUES ('0002');
-
-COMMIT;
\ No newline at end of file
@@ -1,8 +1,6 @@
--- 003_add_tags.sql
+-- 0003_add_tags.sql
 -- Add JSON tags column for ML classification results
 
-BEGIN TRANSACTION;
-
 -- Add tags column (stores JSON array of strings)
 ALTER TABLE articles ADD COLUMN tags TEXT DEFAULT '[]';
 
@@ -25,7 +23,3 @@ SELECT
     hash
 FROM articles;
 
--- Record schema version
-INSERT INTO schema_version(version) VALUES ('0003');
-
-COMMIT;